@@ -1,281 +1,566 @@
 # Import required libraries
 import os  # For environment variables
-from typing import TypedDict, List, Dict, Any  # Type hints for better code documentation
+import asyncio  # Event loop for the interactive CLI
+import functools  # Lazy one-time initialization helpers
+from collections import defaultdict  # Inverted index for keyword search
+from dataclasses import dataclass, field  # Workflow state container
+from typing import List, Dict, Any, AsyncIterator, Iterator, Optional, Set, Tuple  # Type hints for better code documentation
 from langgraph.graph import StateGraph, END  # LangGraph for workflow management
 from langchain_openai import ChatOpenAI  # OpenAI LLM integration
-from langchain.schema import HumanMessage, SystemMessage  # Message types for LLM communication
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage  # Message types for LLM communication
+from langchain_core.runnables import RunnableLambda  # Wraps sync/async node functions
+from langchain_core.utils.json import parse_partial_json  # Parses incomplete JSON while streaming
+from langchain_core.globals import set_llm_cache  # Global LLM response cache hook
+from langchain_community.cache import SQLiteCache  # Persistent cache backend for LLM responses
 import json  # JSON handling for data structures
-import re  # Regular expressions (imported but not used)
+import re  # Regular expressions for standard number lookup
 import requests  # HTTP requests for web search functionality
+from requests.adapters import HTTPAdapter  # Connection pooling for the shared HTTP session
+from urllib3.util.retry import Retry  # Retry policy for transient HTTP failures
+import tiktoken  # Token counting for conversation history
 from dotenv import load_dotenv  # Load environment variables from .env file
+from prompt_toolkit import PromptSession  # Async line input for the CLI
+from prompt_toolkit.patch_stdout import patch_stdout  # Print answers above the input line
 
 # Load environment variables from .env file
 load_dotenv()
 
+# SQLite file for cached LLM responses: next to this module unless ISO_AGENT_CACHE_PATH is set
+_LLM_CACHE_PATH = os.getenv(
+    "ISO_AGENT_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".iso_cache.db")
+)
+
+# Cache LLM responses so repeated queries skip the OpenAI round-trip.
+# Note: set_llm_cache is process-global, so importing this module replaces any
+# LangChain LLM cache the host application configured.
+# (for production deployments, swap in RedisCache(redis.Redis.from_url(...)))
+set_llm_cache(SQLiteCache(database_path=_LLM_CACHE_PATH))
+
+# (connect, read) timeout applied to every outgoing HTTP call made through _http_get
+_HTTP_TIMEOUT = (3, 10)
+
+# Static search notes (in real implementation, you would use actual search API)
+_WEB_SEARCH_RESULTS = """Recent ISO medical device standards information:
+- ISO standards are regularly updated and maintained by the International Organization for Standardization
+- Medical device standards focus on quality management, risk management, and software lifecycle processes
+- Current versions should be verified through official ISO website or regulatory bodies
+- Standards may have amendments or technical corrigenda that update requirements
+
+Note: For most current information, consult official ISO catalog or regulatory guidance documents."""
+
+# Built-in database of medical device ISO standards
+_ISO_STANDARDS_DB: Dict[str, Dict[str, str]] = {
+    # ISO 13485: Quality Management Systems
+    "ISO 13485": {
+        "topic": "Quality Management Systems for Medical Devices",
+        "scope": "Requirements for quality management system for medical device organizations",
+        "product_application": "All medical devices and related services",
+        "publication_date": "2016 (current version)",
+        "description": "Specifies requirements for a quality management system where an organization needs to demonstrate its ability to provide medical devices and related services that consistently meet customer and applicable regulatory requirements."
+    },
+    # ISO 14971: Risk Management
+    "ISO 14971": {
+        "topic": "Risk Management for Medical Devices",
+        "scope": "Application of risk management to medical devices",
+        "product_application": "All medical devices throughout their lifecycle",
+        "publication_date": "2019 (current version)",
+        "description": "Specifies a process for a manufacturer to identify the hazards associated with medical devices, to estimate and evaluate the associated risks, to control these risks, and to monitor the effectiveness of the controls."
+    },
+    # IEC 62304: Software Life Cycle
+    "IEC 62304": {
+        "topic": "Medical Device Software - Software Life Cycle Processes",
+        "scope": "Software development life cycle processes for medical device software",
+        "product_application": "Medical device software and software as medical devices",
+        "publication_date": "2006 (current version)",
+        "description": "Defines the life cycle requirements for medical device software. The processes, activities, and tasks described in this standard establish a common framework for medical device software life cycle processes."
+    }
+}
+
+# Word tokens used for keyword search (lowercase letters and digits)
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Inverted index for keyword search: token -> IDs of standards whose text fields contain it
+# (plus the lowercased text itself for phrase/prefix matching)
+_INDEX: Dict[str, Set[str]] = defaultdict(set)
+_SEARCHABLE_TEXT: Dict[str, str] = {}
+for _standard_id, _info in _ISO_STANDARDS_DB.items():
+    _text = f"{_info['topic']} {_info['scope']} {_info['product_application']} {_info['description']}".lower()
+    _SEARCHABLE_TEXT[_standard_id] = _text
+    for _token in _TOKEN_RE.findall(_text):
+        _INDEX[_token].add(_standard_id)
+
+# Serialized once, compact (no indentation) to save prompt tokens
+_ISO_STANDARDS_DB_JSON = json.dumps(_ISO_STANDARDS_DB, separators=(",", ":"))
+
+# Static part of the answer prompt: instructions, output format and database.
+# Variable content (search results, history, user query) must come after this prefix.
+_STATIC_PREFIX = """You are an ISO medical device standards expert. Based on the user query and web search results, provide detailed information about relevant ISO standards.
+
+First analyze the user query and determine if it's asking about:
+1. A specific ISO standard number
+2. A medical device category
+3. A general inquiry about medical standards
+
+Combine information from the database and web search results. If web search indicates newer versions or updates, mention them.
+If the query mentions a specific ISO number, focus on that. If it's about a device category, suggest relevant standards.
+If the standard is not in the database, use web search results and your knowledge to provide information.
+
+Return a JSON object with this schema:
+{"standards": [{"id": "ISO number", "topic": "main subject area", "scope": "what it covers", "product_application": "which devices/products", "publication_date": "when published/updated", "summary": "brief description"}]}
+
+If multiple standards are relevant, add one entry per standard. If none are relevant, return {"standards": []}.
+Be concise but comprehensive.
+
+Available standards database: """ + _ISO_STANDARDS_DB_JSON
+
+# Standard numbers, e.g. "ISO 13485", "iso14971", "IEC 62304".
+# Only applied to the "ids" group of a matched lookup, never to free text.
+_ISO_ID_PATTERN = r"(?:ISO|IEC)\s*\d{3,5}"
+_ISO_ID_RE = re.compile(r"(ISO|IEC)\s*(\d{3,5})", re.IGNORECASE)
+
+# Whole query that is only a lookup: one or more standard numbers, optionally with
+# filler such as "what is" / "tell me about", e.g. "What is ISO 13485?", "iec62304",
+# "Tell me about ISO 13485 and ISO 14971". Used with fullmatch; anything else goes to the LLM.
+_ISO_LOOKUP_RE = re.compile(
+    r"\s*(?:(?:what\s+(?:is|are)|what's|tell\s+me\s+about|show\s+me|info(?:rmation)?\s+(?:on|about)|describe|explain|look\s*up)\s+)?"
+    r"(?:the\s+)?(?:standards?\s+)?"
+    rf"(?P<ids>{_ISO_ID_PATTERN}(?:\s*(?:,|and|&)\s*{_ISO_ID_PATTERN})*)"
+    r"(?:\s+standards?)?\s*[?.!]*\s*",
+    re.IGNORECASE
+)
+
+# Token budget for conversation history sent with each query
+_HISTORY_TOKEN_BUDGET = 1500
+
+# Tokenizer is loaded on first use (it may need to download its encoding file).
+# Returns None if it can't be loaded, e.g. offline; the result is cached either way.
+@functools.lru_cache(maxsize=None)
+def _history_encoding() -> Optional[tiktoken.Encoding]:
+    try:
+        return tiktoken.encoding_for_model("gpt-4o-mini")
+    except Exception:
+        return None
+
+# Token count for history trimming, estimated at ~4 characters per token without a tokenizer
+def _count_tokens(text: str) -> int:
+    encoding = _history_encoding()
+    if encoding is None:
+        return len(text) // 4
+    return len(encoding.encode(text))
+
+# Keep the most recent exchanges that fit within the token budget
+def _trim_history(history: List[Dict[str, str]], max_tokens: int = _HISTORY_TOKEN_BUDGET) -> List[Dict[str, str]]:
+    # Nothing to count on the first turn, so skip loading the tokenizer
+    if not history:
+        return []
+    kept = []
+    total = 0
+    for exchange in reversed(history):
+        tokens = _count_tokens(exchange["user"]) + _count_tokens(exchange["bot"])
+        if total + tokens > max_tokens:
+            break
+        kept.append(exchange)
+        total += tokens
+    kept.reverse()
+    return kept
+
+# Response layout: header, then one block per standard separated by rules
+_RESPONSE_HEADER = "📋 **ISO Standard Information**\n\n"
+_STANDARD_SEPARATOR = "\n\n---\n\n"
+
+# Lines of a rendered standard, each with the fields it needs (also used to stream a standard line by line)
+_STANDARD_LINES = [
+    ("**Standard:** {id} - {topic}\n", ("id", "topic")),
+    ("**Topic:** {topic}\n", ("topic",)),
+    ("**Scope:** {scope}\n", ("scope",)),
+    ("**Product Application:** {product_application}\n", ("product_application",)),
+    ("**Publication Date:** {publication_date}\n\n", ("publication_date",)),
+    ("**Summary:** {summary}", ("summary",)),
+]
+
+# Render one standard (from the database or the LLM's JSON) as a markdown block
+def _render_standard(info: Dict[str, str]) -> str:
+    values = defaultdict(str, info)
+    return "".join(template.format_map(values) for template, _ in _STANDARD_LINES)
+
+# Render the leading lines of a standard that is still being streamed.
+# Every key except the last one in the partial object is complete; the summary is shown as it grows.
+def _render_standard_prefix(partial: Dict[str, Any]) -> str:
+    keys = list(partial)
+    closed = set(keys[:-1])
+    values = defaultdict(str, partial)
+    text = ""
+    for template, fields in _STANDARD_LINES:
+        if closed.issuperset(fields):
+            text += template.format_map(values)
+        elif fields == ("summary",) and keys[-1] == "summary":
+            text += template.format_map(values)  # Summary text received so far
+        else:
+            break
+    return text
+
+# Shown instead of standard blocks when the LLM finds nothing relevant
+_NO_STANDARDS_MESSAGE = "No relevant ISO standards were found for this query."
+# Shown when the LLM output isn't usable, so a parse failure is never reported as "no standards"
+_UNREADABLE_MESSAGE = "⚠️ The answer could not be parsed or was cut off. Please try again or rephrase the question."
+# Appended when the output was cut off after at least one complete standard
+_CUT_OFF_NOTE = "⚠️ The answer was cut off; further standards may be missing."
+
+# Render a list of standards as the full user-facing response.
+# standards is None when the LLM output could not be parsed.
+def _render_standards(standards: Optional[List[Dict[str, str]]], truncated: bool = False) -> str:
+    if standards is None:
+        return _RESPONSE_HEADER + _UNREADABLE_MESSAGE
+    if not standards:
+        return _RESPONSE_HEADER + _NO_STANDARDS_MESSAGE
+    response = _RESPONSE_HEADER + _STANDARD_SEPARATOR.join(_render_standard(info) for info in standards)
+    if truncated:
+        response += _STANDARD_SEPARATOR + _CUT_OFF_NOTE
+    return response
+
+# Start of the expected output object, up to the opening bracket of the standards array
+_STANDARDS_ARRAY_RE = re.compile(r'\s*\{\s*"standards"\s*:\s*\[')
+_JSON_DECODER = json.JSONDecoder()
+
+# Scan (possibly incomplete) output for the entries of the standards array that are fully closed.
+# Returns (entries, offset where the next unfinished entry starts, whether the array is closed),
+# or None if the output doesn't start with {"standards": [.
+def _closed_entries(content: str) -> Optional[Tuple[List[Any], int, bool]]:
+    match = _STANDARDS_ARRAY_RE.match(content)
+    if match is None:
+        return None
+    entries = []
+    offset = match.end()
+    while True:
+        while offset < len(content) and content[offset] in " \t\r\n,":
+            offset += 1
+        if offset < len(content) and content[offset] == "]":
+            return entries, offset, True
+        try:
+            entry, offset = _JSON_DECODER.raw_decode(content, offset)
+        except json.JSONDecodeError:
+            return entries, offset, False
+        entries.append(entry)
+
+# Keep standard objects only; None if there were entries but none of them were objects (wrong schema)
+def _standard_dicts(entries: List[Any]) -> Optional[List[Dict[str, str]]]:
+    standards = [info for info in entries if isinstance(info, dict)]
+    if entries and not standards:
+        return None
+    return standards
+
+# Extract the standards list from the LLM's JSON output.
+# Returns (standards, truncated): standards is None when the output is not usable
+# (not JSON, a refusal, wrong schema, or cut off before any standard was complete).
+# If the output was cut off (e.g. by max_tokens), the complete entries are kept and truncated is True.
+def _parse_standards(content: str) -> Tuple[Optional[List[Dict[str, str]]], bool]:
+    try:
+        parsed = json.loads(content)
+    except json.JSONDecodeError:
+        scanned = _closed_entries(content)
+        if scanned is None:
+            return None, False
+        entries, _, _ = scanned
+        return (_standard_dicts(entries) or None), True
+    entries = parsed.get("standards") if isinstance(parsed, dict) else None
+    if not isinstance(entries, list):
+        return None, False
+    return _standard_dicts(entries), False
+
+# Render as much of the response as streamed JSON content allows: the header once the standards
+# array has started, every complete standard, then the closed lines of the standard in progress.
+# The text only grows as content grows, so the difference can be printed as it arrives.
+def _stream_text(content: str) -> str:
+    scanned = _closed_entries(content)
+    if scanned is None:
+        return ""
+    entries, offset, array_closed = scanned
+    blocks = [_render_standard(info) for info in entries if isinstance(info, dict)]
+    if not array_closed:
+        try:
+            partial = parse_partial_json(content[offset:])
+        except json.JSONDecodeError:
+            partial = None
+        if isinstance(partial, dict) and partial:
+            prefix = _render_standard_prefix(partial)
+            if prefix:
+                blocks.append(prefix)
+    return _RESPONSE_HEADER + _STANDARD_SEPARATOR.join(blocks)
+
+# Accumulates the answer node's streamed JSON tokens and yields the newly rendered text.
+# Shared by chat_stream() and achat_stream().
+class _StreamRenderer:
+    def __init__(self):
+        self.content = ""  # JSON text received so far
+        self.emitted = ""  # Rendered text already yielded
+    
+    def feed(self, chunk: BaseMessage, metadata: Dict[str, Any]) -> List[str]:
+        # Ignore tokens from anything other than the answer node
+        if metadata.get("langgraph_node") != "answer" or not chunk.content:
+            return []
+        self.content += chunk.content
+        return self._emit(_stream_text(self.content))
+    
+    def finish(self) -> List[str]:
+        # Render whatever is left once the full JSON is available
+        standards, truncated = _parse_standards(self.content)
+        final = _render_standards(standards, truncated)
+        if final.startswith(self.emitted):
+            return self._emit(final)
+        # Already streamed part of a standard that never completed (or the output was unusable)
+        if standards is None:
+            note = _UNREADABLE_MESSAGE
+        elif truncated:
+            note = _CUT_OFF_NOTE
+        else:
+            note = _render_standards(standards)
+        self.emitted += _STANDARD_SEPARATOR + note
+        return [_STANDARD_SEPARATOR + note]
+    
+    def _emit(self, text: str) -> List[str]:
+        # Yield only the new text; anything that doesn't extend what was shown waits for finish()
+        if len(text) <= len(self.emitted) or not text.startswith(self.emitted):
+            return []
+        piece = text[len(self.emitted):]
+        self.emitted = text
+        return [piece]
+
 # Define the state structure for the LangGraph workflow
-class ISOStandardState(TypedDict):
-    query: str  # User's input query
-    standard_info: Dict[str, Any]  # Processed information about ISO standards
-    web_search_results: str  # Results from web search
-    response: str  # Final formatted response to user
-    conversation_history: List[Dict[str, str]]  # Chat history for context
+# (slotted dataclass keeps per-request state small; nodes return only changed fields)
+@dataclass(slots=True)
+class ISOStandardState:
+    query: str = ""  # User's input query
+    standard_info: Dict[str, Any] = field(default_factory=dict)  # Processed information about ISO standards
+    web_search_results: str = ""  # Results from web search
+    response: str = ""  # Final formatted response to user
+    conversation_history: List[Dict[str, str]] = field(default_factory=list)  # Chat history for context
 
 # Main agent class for ISO medical device standards
 class ISOMedicalStandardAgent:
+    # LLM clients shared by all agent instances, keyed by (api_key, model, temperature, max_tokens)
+    _LLM_CACHE: Dict[Tuple[str, str, float, int], ChatOpenAI] = {}
+    # HTTP session shared by all agent instances, created on first use
+    _HTTP_SESSION: Optional[requests.Session] = None
+    
     def __init__(self, openai_api_key: str):
-        # Initialize main LLM for general processing
-        self.llm = ChatOpenAI(
-            api_key=openai_api_key,  # OpenAI API key
-            model="gpt-4.1-mini",  # GPT model version
-            temperature=0.1  # Low temperature for consistent responses
-        )
-        # Initialize separate LLM for web search query generation
-        self.search_llm = ChatOpenAI(
-            api_key=openai_api_key,  # Same API key
-            model="gpt-4.1-mini",  # Same model
-            temperature=0.1  # Low temperature for focused search queries
-        )
+        # Reuse the main LLM client if another agent already created it
+        # (answers are a short JSON list of standards, so output is capped at 800 tokens)
+        self.llm = self._get_llm(openai_api_key, "gpt-4.1-mini", 0.1, 800)
         # Build and compile the workflow graph
         self.graph = self._build_graph()
         
+    @classmethod
+    def _get_llm(cls, api_key: str, model: str, temperature: float, max_tokens: int) -> ChatOpenAI:
+        # Create each client (and its HTTP connection pool) once per configuration
+        key = (api_key, model, temperature, max_tokens)
+        if key not in cls._LLM_CACHE:
+            cls._LLM_CACHE[key] = ChatOpenAI(
+                api_key=api_key,  # OpenAI API key
+                model=model,  # GPT model version
+                temperature=temperature,  # Low temperature for consistent responses
+                max_tokens=max_tokens,  # Bound generation length to keep tail latency down
+                streaming=True,  # Stream tokens so the CLI can print them as they arrive
+                extra_body={"prompt_cache_key": "iso_answer_v1"},  # Pin prompt-cache routing for the static prefix
+                model_kwargs={"response_format": {"type": "json_object"}}  # Structured output rendered in Python
+            )
+        return cls._LLM_CACHE[key]
+        
+    @classmethod
+    def _get_http(cls) -> requests.Session:
+        # One pooled session for web search calls: reuses TCP/TLS connections across agents
+        if cls._HTTP_SESSION is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=10, pool_maxsize=10, max_retries=Retry(total=2, backoff_factor=0.1))
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            cls._HTTP_SESSION = session
+        return cls._HTTP_SESSION
+    
+    def _http_get(self, url: str, **kwargs: Any) -> requests.Response:
+        # Entry point for a real web search API; always bounded by _HTTP_TIMEOUT
+        kwargs.setdefault("timeout", _HTTP_TIMEOUT)
+        return self._get_http().get(url, **kwargs)
+        
     def keyword_search(self, keywords: str) -> Dict[str, Any]:
         """Search ISO standards database using keywords"""
-        iso_standards_db = {
-            "ISO 13485": {
-                "topic": "Quality Management Systems for Medical Devices",
-                "scope": "Requirements for quality management system for medical device organizations",
-                "product_application": "All medical devices and related services",
-                "publication_date": "2016 (current version)",
-                "description": "Specifies requirements for a quality management system where an organization needs to demonstrate its ability to provide medical devices and related services that consistently meet customer and applicable regulatory requirements."
-            },
-            "ISO 14971": {
-                "topic": "Risk Management for Medical Devices",
-                "scope": "Application of risk management to medical devices",
-                "product_application": "All medical devices throughout their lifecycle",
-                "publication_date": "2019 (current version)",
-                "description": "Specifies a process for a manufacturer to identify the hazards associated with medical devices, to estimate and evaluate the associated risks, to control these risks, and to monitor the effectiveness of the controls."
-            },
-            "IEC 62304": {
-                "topic": "Medical Device Software - Software Life Cycle Processes",
-                "scope": "Software development life cycle processes for medical device software",
-                "product_application": "Medical device software and software as medical devices",
-                "publication_date": "2006 (current version)",
-                "description": "Defines the life cycle requirements for medical device software. The processes, activities, and tasks described in this standard establish a common framework for medical device software life cycle processes."
-            }
-        }
-        
         keywords_lower = keywords.lower()
-        results = {}
-        
-        for standard_id, info in iso_standards_db.items():
-            # Search in all text fields
-            searchable_text = f"{info['topic']} {info['scope']} {info['product_application']} {info['description']}".lower()
-            if keywords_lower in searchable_text:
-                results[standard_id] = info
-                
-        return results
+        tokens = _TOKEN_RE.findall(keywords_lower)
+        
+        # Standards that contain every keyword token
+        matches = set.intersection(*(_INDEX.get(token, set()) for token in tokens)) if tokens else set()
+        if not matches:
+            # Fall back to phrase/prefix matching on the text fields (e.g. "quality manage")
+            matches = {standard_id for standard_id, text in _SEARCHABLE_TEXT.items() if keywords_lower in text}
+        return {standard_id: _ISO_STANDARDS_DB[standard_id] for standard_id in sorted(matches)}
+        
+    def _direct_lookup(self, query: str) -> Optional[str]:
+        # Answer plain standard-number lookups straight from the database, skipping the LLM.
+        # Questions that merely mention a standard ("Is ISO 13485 required by the FDA?") are not lookups.
+        match = _ISO_LOOKUP_RE.fullmatch(query)
+        if match is None:
+            return None
+        standard_ids = [f"{body.upper()} {number}" for body, number in _ISO_ID_RE.findall(match.group("ids"))]
+        if any(standard_id not in _ISO_STANDARDS_DB for standard_id in standard_ids):
+            return None
+        
+        standards = []
+        for standard_id in dict.fromkeys(standard_ids):  # Deduplicate, keep order
+            info = _ISO_STANDARDS_DB[standard_id]
+            standards.append({"id": standard_id, "summary": info["description"], **info})
+        return _render_standards(standards)
         
     def _build_graph(self):
         # Create a new StateGraph with our defined state structure
         workflow = StateGraph(ISOStandardState)
         
-        # Add nodes (processing steps) to the workflow
-        workflow.add_node("analyze_query", self._analyze_query)  # Step 1: Analyze user query
-        workflow.add_node("web_search", self._web_search)  # Step 2: Perform web search
-        workflow.add_node("extract_standard_info", self._extract_standard_info)  # Step 3: Extract ISO info
-        workflow.add_node("format_response", self._format_response)  # Step 4: Format final response
+        # Single node: analyze, extract and format in one LLM call
+        # (sync and async implementations so both invoke() and ainvoke() work)
+        workflow.add_node("answer", RunnableLambda(self._answer, afunc=self._aanswer))
         
         # Define the workflow sequence
-        workflow.set_entry_point("analyze_query")  # Start with query analysis
-        workflow.add_edge("analyze_query", "web_search")  # Then web search
-        workflow.add_edge("web_search", "extract_standard_info")  # Then extract info
-        workflow.add_edge("extract_standard_info", "format_response")  # Then format response
-        workflow.add_edge("format_response", END)  # End the workflow
+        workflow.set_entry_point("answer")  # Start with the fused answer step
+        workflow.add_edge("answer", END)  # End the workflow
         
         # Compile and return the executable workflow
         return workflow.compile()
     
-    def _analyze_query(self, state: ISOStandardState) -> ISOStandardState:
-        # Extract the user query from state
-        query = state["query"]
-        
-        # Define system prompt for query analysis
-        system_prompt = """You are an expert in ISO medical device standards. 
-        Analyze the user query and determine if it's asking about:
-        1. A specific ISO standard number
-        2. A medical device category
-        3. A general inquiry about medical standards
-        
-        Extract any ISO standard numbers mentioned (e.g., ISO 13485, ISO 14971, etc.)."""
-        
-        # Create message list for LLM
-        messages = [
-            SystemMessage(content=system_prompt),  # System instructions
-            HumanMessage(content=f"Query: {query}")  # User query
-        ]
-        
-        # Get analysis from LLM
-        response = self.llm.invoke(messages)
-        # Store analysis results in state
-        state["standard_info"] = {"analysis": response.content}
-        return state
-    
-    def _web_search(self, state: ISOStandardState) -> ISOStandardState:
+    def _answer_messages(self, state: ISOStandardState) -> List[BaseMessage]:
         # Get user query from state
-        query = state["query"]
-        
-        # Create search query for ISO standards using LLM
-        search_prompt = f"""Create a web search query to find current information about ISO medical device standards based on this user query: {query}
-        
-        Focus on finding:
-        - Official ISO standard documents
-        - Publication dates and current versions
-        - Scope and application information
-        - Medical device regulatory information
-        
-        Return only the search query, nothing else."""
-        
-        # Prepare messages for search LLM
-        messages = [
-            SystemMessage(content=search_prompt),  # Instructions for search query creation
-            HumanMessage(content=query)  # Original user query
-        ]
-        
-        # Generate search query using dedicated search LLM
-        search_query_response = self.search_llm.invoke(messages)
-        search_query = search_query_response.content.strip()  # Clean the response
+        query = state.query
         
-        # Simulate web search results (in real implementation, you would use actual search API)
-        search_results = f"""Search query: {search_query}
+        # Use live search results when present, otherwise the static notes
+        web_results = state.web_search_results or _WEB_SEARCH_RESULTS
         
-        Recent ISO medical device standards information:
-        - ISO standards are regularly updated and maintained by the International Organization for Standardization
-        - Medical device standards focus on quality management, risk management, and software lifecycle processes
-        - Current versions should be verified through official ISO website or regulatory bodies
-        - Standards may have amendments or technical corrigenda that update requirements
+        # Static instructions and database first so OpenAI can cache the prompt prefix
+        system_prompt = _STATIC_PREFIX + f"\n\nWeb search results: {web_results}"
         
-        Note: For most current information, consult official ISO catalog or regulatory guidance documents."""
+        # Recent history goes into the user turn as plain context; replaying the rendered markdown
+        # as assistant turns would contradict the JSON-only response format
+        history = "\n\n".join(
+            f"User: {exchange['user']}\nAssistant: {exchange['bot']}"
+            for exchange in _trim_history(state.conversation_history)
+        )
+        user_prompt = f"User query: {query}"
+        if history:
+            user_prompt = f"Earlier conversation (for context only):\n{history}\n\n{user_prompt}"
         
-        # Store search results in state
-        state["web_search_results"] = search_results
-        return state
+        # Prepare messages for LLM processing: instructions with data and format, then the query
+        return [SystemMessage(content=system_prompt), HumanMessage(content=user_prompt)]
     
-    def _extract_standard_info(self, state: ISOStandardState) -> ISOStandardState:
-        # Get user query and web search results from state
-        query = state["query"]
-        web_results = state.get("web_search_results", "")  # Get web results or empty string
-        
-        # Built-in database of medical device ISO standards
-        iso_standards_db = {
-            # ISO 13485: Quality Management Systems
-            "ISO 13485": {
-                "topic": "Quality Management Systems for Medical Devices",
-                "scope": "Requirements for quality management system for medical device organizations",
-                "product_application": "All medical devices and related services",
-                "publication_date": "2016 (current version)",
-                "description": "Specifies requirements for a quality management system where an organization needs to demonstrate its ability to provide medical devices and related services that consistently meet customer and applicable regulatory requirements."
-            },
-            # ISO 14971: Risk Management
-            "ISO 14971": {
-                "topic": "Risk Management for Medical Devices",
-                "scope": "Application of risk management to medical devices",
-                "product_application": "All medical devices throughout their lifecycle",
-                "publication_date": "2019 (current version)",
-                "description": "Specifies a process for a manufacturer to identify the hazards associated with medical devices, to estimate and evaluate the associated risks, to control these risks, and to monitor the effectiveness of the controls."
-            },
-            # IEC 62304: Software Life Cycle
-            "IEC 62304": {
-                "topic": "Medical Device Software - Software Life Cycle Processes",
-                "scope": "Software development life cycle processes for medical device software",
-                "product_application": "Medical device software and software as medical devices",
-                "publication_date": "2006 (current version)",
-                "description": "Defines the life cycle requirements for medical device software. The processes, activities, and tasks described in this standard establish a common framework for medical device software life cycle processes."
-            }
+    def _answer_update(self, response: BaseMessage) -> Dict[str, Any]:
+        # Parse the structured standards and format them in Python.
+        # Only the changed fields are returned; LangGraph merges them into the state.
+        standards, truncated = _parse_standards(response.content)
+        return {
+            "standard_info": {"standards": standards or [], "parsed": standards is not None, "truncated": truncated},
+            "response": _render_standards(standards, truncated)
         }
-        
-        # Create comprehensive system prompt combining database and web search results
-        system_prompt = f"""You are an ISO medical device standards expert. Based on the user query and web search results, provide detailed information about relevant ISO standards.
-
-Available standards database: {json.dumps(iso_standards_db, indent=2)}
-
-Web search results: {web_results}
-
-For each relevant standard, provide:
-1. Topic: What the standard covers
-2. Scope: The range and boundaries of the standard
-3. Product Application: Which medical devices/products it applies to
-4. Publication Date: When it was published/last updated
-
-Combine information from the database and web search results. If web search indicates newer versions or updates, mention them.
-If the query mentions a specific ISO number, focus on that. If it's about a device category, suggest relevant standards.
-If the standard is not in the database, use web search results and your knowledge to provide information."""
-        
-        # Prepare messages for LLM processing
-        messages = [
-            SystemMessage(content=system_prompt),  # Expert instructions with data
-            HumanMessage(content=f"User query: {query}")  # User's original query
-        ]
-        
-        # Extract and process standard information using LLM
-        response = self.llm.invoke(messages)
-        # Store extracted information in state
-        state["standard_info"]["extracted_info"] = response.content
-        return state
     
-    def _format_response(self, state: ISOStandardState) -> ISOStandardState:
-        # Get the extracted information from previous step
-        extracted_info = state["standard_info"]["extracted_info"]
-        
-        # Define formatting instructions for consistent output
-        system_prompt = """Format the ISO standard information in a clear, structured way for the user.
-        Use the following format:
-
-        📋 **ISO Standard Information**
-        
-        **Standard:** [ISO Number and Title]
-        **Topic:** [Main subject area]
-        **Scope:** [What it covers]
-        **Product Application:** [Which devices/products]
-        **Publication Date:** [When published/updated]
-        
-        **Summary:** [Brief description]
-        
-        If multiple standards are relevant, list them separately.
-        Be concise but comprehensive."""
-        
-        # Prepare messages for final formatting
-        messages = [
-            SystemMessage(content=system_prompt),  # Formatting instructions
-            HumanMessage(content=f"Information to format: {extracted_info}")  # Raw info to format
-        ]
-        
-        # Format the final response using LLM
-        response = self.llm.invoke(messages)
-        # Store final formatted response in state
-        state["response"] = response.content
-        return state
+    def _answer(self, state: ISOStandardState) -> Dict[str, Any]:
+        # Get structured standards from a single LLM call
+        return self._answer_update(self.llm.invoke(self._answer_messages(state)))
+    
+    async def _aanswer(self, state: ISOStandardState) -> Dict[str, Any]:
+        # Async variant used by achat() so concurrent queries don't block each other
+        return self._answer_update(await self.llm.ainvoke(self._answer_messages(state)))
+    
+    def _initial_state(self, query: str, conversation_history: List[Dict[str, str]] = None) -> ISOStandardState:
+        # Create initial state for the workflow (other fields use their defaults)
+        return ISOStandardState(
+            query=query,  # User's input query
+            conversation_history=conversation_history or []  # Chat history for context
+        )
     
     def chat(self, query: str, conversation_history: List[Dict[str, str]] = None) -> str:
-        # Initialize conversation history if not provided
-        if conversation_history is None:
-            conversation_history = []
-            
-        # Create initial state for the workflow
-        initial_state = {
-            "query": query,  # User's input query
-            "standard_info": {},  # Empty dict to store standard information
-            "web_search_results": "",  # Empty string for search results
-            "response": "",  # Empty string for final response
-            "conversation_history": conversation_history  # Chat history for context
-        }
+        # Skip the workflow entirely for direct standard-number lookups
+        direct = self._direct_lookup(query)
+        if direct is not None:
+            return direct
         
         # Execute the complete workflow and get final result
-        result = self.graph.invoke(initial_state)
+        result = self.graph.invoke(self._initial_state(query, conversation_history))
         # Return the formatted response to user
         return result["response"]
+    
+    def chat_batch(self, queries: List[str], max_concurrency: int = 10) -> List[str]:
+        # Answer direct lookups locally, then run the remaining queries through the workflow concurrently
+        responses = [self._direct_lookup(query) for query in queries]
+        pending = [i for i, response in enumerate(responses) if response is None]
+        
+        if pending:
+            states = [self._initial_state(queries[i]) for i in pending]
+            results = self.graph.batch(states, config={"max_concurrency": max_concurrency})
+            for i, result in zip(pending, results):
+                responses[i] = result["response"]
+        
+        return responses
+    
+    def chat_stream(self, query: str, conversation_history: List[Dict[str, str]] = None) -> Iterator[str]:
+        # Direct standard-number lookups are answered in one chunk
+        direct = self._direct_lookup(query)
+        if direct is not None:
+            yield direct
+            return
+        
+        # Run the workflow; the response is yielded line by line as the LLM's JSON arrives
+        renderer = _StreamRenderer()
+        for chunk, metadata in self.graph.stream(self._initial_state(query, conversation_history), stream_mode="messages"):
+            yield from renderer.feed(chunk, metadata)
+        yield from renderer.finish()
+    
+    async def achat_stream(self, query: str, conversation_history: List[Dict[str, str]] = None) -> AsyncIterator[str]:
+        # Async version of chat_stream(), used by the interactive CLI
+        direct = self._direct_lookup(query)
+        if direct is not None:
+            yield direct
+            return
+        
+        renderer = _StreamRenderer()
+        async for chunk, metadata in self.graph.astream(self._initial_state(query, conversation_history), stream_mode="messages"):
+            for piece in renderer.feed(chunk, metadata):
+                yield piece
+        for piece in renderer.finish():
+            yield piece
+    
+    async def achat(self, query: str, conversation_history: List[Dict[str, str]] = None) -> str:
+        # Async version of chat(); many queries can be awaited concurrently
+        direct = self._direct_lookup(query)
+        if direct is not None:
+            return direct
+        
+        result = await self.graph.ainvoke(self._initial_state(query, conversation_history))
+        return result["response"]
 
-# Main function to run the command-line interface
-def main():
+# Answer queued queries one at a time, streaming each response as it is rendered
+async def _answer_queue(agent: ISOMedicalStandardAgent, queue: asyncio.Queue) -> None:
+    # Initialize conversation history list
+    conversation_history = []
+    
+    while True:
+        user_input = await queue.get()
+        try:
+            # Stream the bot response with custom name as it is rendered
+            print(f"\nZenTH med_bot ({user_input}):")
+            pieces = []
+            async for piece in agent.achat_stream(user_input, conversation_history):
+                print(piece, end="", flush=True)
+                pieces.append(piece)
+            print("\n")
+            response = "".join(pieces)
+            
+            # Update conversation history for context, dropping exchanges that no longer fit the token budget
+            conversation_history.append({"user": user_input, "bot": response})
+            conversation_history[:] = _trim_history(conversation_history)
+                
+        except Exception as e:
+            # Handle any errors during processing
+            print(f"Error: {e}")
+        finally:
+            queue.task_done()
+
+# Async command-line interface: the user can type the next question while the previous one is answered
+async def amain():
     # Load environment variables from .env file
     load_dotenv()
     
@@ -294,39 +579,46 @@ def main():
     print("Ask me about ISO standards for medical devices!")
     print("Type 'quit' to exit\n")
     
-    # Initialize conversation history list
-    conversation_history = []
+    # Pending queries are answered in the background in the order they were typed
+    queue: asyncio.Queue = asyncio.Queue()
+    session = PromptSession("You: ")
     
-    # Main chat loop
-    while True:
-        # Get user input
-        user_input = input("You: ").strip()
-        
-        # Check for exit commands
-        if user_input.lower() in ['quit', 'exit', 'bye']:
-            print("Goodbye!")
-            break
-            
-        # Skip empty inputs
-        if not user_input:
-            continue
-            
-        try:
-            # Process user query through the agent
-            response = agent.chat(user_input, conversation_history)
-            # Display bot response with custom name
-            print(f"\nZenTH med_bot: {response}\n")
-            
-            # Update conversation history for context
-            conversation_history.append({"user": user_input, "bot": response})
+    with patch_stdout():
+        worker = asyncio.create_task(_answer_queue(agent, queue))
+        
+        # Main chat loop
+        while True:
+            # Get user input without blocking the answer worker
+            try:
+                user_input = (await session.prompt_async()).strip()
+            except EOFError:
+                user_input = "quit"
+            except KeyboardInterrupt:
+                # Ctrl-C exits immediately; say what is being dropped
+                if queue.qsize():
+                    print(f"Dropping {queue.qsize()} queued question(s).")
+                print("Goodbye!")
+                break
             
-            # Keep only last 5 exchanges to manage memory
-            if len(conversation_history) > 5:
-                conversation_history = conversation_history[-5:]
+            # Check for exit commands: finish answering queued questions first
+            if user_input.lower() in ['quit', 'exit', 'bye']:
+                if queue.qsize():
+                    print(f"Answering {queue.qsize()} queued question(s) before exiting...")
+                await queue.join()
+                print("Goodbye!")
+                break
                 
-        except Exception as e:
-            # Handle any errors during processing
-            print(f"Error: {e}")
+            # Skip empty inputs
+            if not user_input:
+                continue
+            
+            await queue.put(user_input)
+        
+        worker.cancel()
+
+# Main function to run the command-line interface
+def main():
+    asyncio.run(amain())
 
 # Run the main function if script is executed directly
 if __name__ == "__main__":